@@ -1,236 +1,301 @@
 import argparse
+import copy
 import sys
 import math
-from lark import Lark, Transformer, v_args, Tree
-from lark.exceptions import LarkError
+from typing import Any, Callable, Dict, List, Optional, Union
+from lark import Lark, Token, Transformer, v_args
+from lark.exceptions import LarkError, VisitError
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 
 GRAMMAR = """
 start: item*
 
-item: const
-    | array
-    | dict
-
-const: "const" CNAME "=" value
-value: number
+?item: const
      | array
      | dict
-     | const_expr
-     | CNAME
+
+const: "const" CNAME "=" value
+?value: number
+      | array
+      | dict
+      | const_expr
+      | CNAME -> value_ref
 
 array: "(" [value ("," value)*] ")"
 dict: "table" "(" "[" dict_entry ("," dict_entry)* "]" ")"
 dict_entry: CNAME "=" value
 
 const_expr: "|" expr "|"
+          | "|" CNAME "|" -> value_ref
 
-expr: term
-    | expr "+" term -> add
-    | expr "-" term -> sub
+?expr: term
+     | expr "+" term -> add
+     | expr "-" term -> sub
 
-term: factor
-    | term "*" factor -> mul
-    | term "/" factor -> div
+?term: factor
+     | term "*" factor -> mul
+     | term "/" factor -> div
 
-factor: number
-      | CNAME
-      | "(" expr ")"
-      | function
+?factor: number
+       | CNAME -> const_ref
+       | "(" expr ")"
+       | function
 
-function: "len" "(" expr ")"
-        | "abs" "(" expr ")"
+function: (LEN | ABS) "(" expr ")"
 
 number: SIGNED_NUMBER
 
 CNAME: /[a-z][a-z0-9_]*/
+LEN: "len"
+ABS: "abs"
+LINE_COMMENT: /![^\\n]*/
+BLOCK_COMMENT: /\\/#[^#]*(?:#(?!\\/)[^#]*)*#\\//
 
 %import common.SIGNED_NUMBER
 %import common.WS
 %ignore WS
-%ignore /![^\\n]*/
-%ignore /\\/#.*?#\\//
+%ignore LINE_COMMENT
+%ignore BLOCK_COMMENT
 """
 
 
-class ConfigTransformer(Transformer):
-    def __init__(self):
-        self.constants = {}
-        super().__init__()
-
-    def _get_value(self, node):
-        """Получает значение из узла или константы"""
-        if isinstance(node, Tree):
-            # Трансформируем дерево
-            return self._transform_tree(node)
-        elif isinstance(node, str):
-            # Если это строка, проверяем, не константа ли это
-            if node in self.constants:
-                return self.constants[node]
-            return node
-        else:
-            # Число или другое значение
-            return node
-
-    def _transform_tree(self, tree):
-        """Трансформирует дерево Lark в значение"""
-        if tree.data == 'value':
-            return self.value(tree.children)
-        elif tree.data == 'const_expr':
-            return self.const_expr(tree.children)
-        elif tree.data == 'add':
-            return self._eval_binary_op(tree.children, lambda a, b: a + b)
-        elif tree.data == 'sub':
-            return self._eval_binary_op(tree.children, lambda a, b: a - b)
-        elif tree.data == 'mul':
-            return self._eval_binary_op(tree.children, lambda a, b: a * b)
-        elif tree.data == 'div':
-            return self._eval_binary_op(tree.children, lambda a, b: a / b if b != 0 else self._zero_division_error())
-        elif tree.data == 'function':
-            return self._eval_function(tree)
-        elif tree.data in ('expr', 'term', 'factor'):
-            # Для внутренних узлов рекурсивно трансформируем
-            return self._get_value(tree.children[0])
-        else:
-            # Для других узлов вызываем соответствующий метод
-            try:
-                method = getattr(self, tree.data)
-                return method(tree.children)
-            except AttributeError:
-                return tree
-
-    def _eval_binary_op(self, children, op_func):
-        """Вычисляет бинарную операцию"""
-        left = self._get_value(children[0])
-        right = self._get_value(children[1])
-
-        if not (isinstance(left, (int, float)) and isinstance(right, (int, float))):
-            raise TypeError(f"Operation requires numbers, got {type(left)} and {type(right)}")
-
-        return op_func(left, right)
-
-    def _eval_function(self, tree):
-        """Вычисляет функцию"""
-        # Получаем имя функции и аргумент из дерева
-        func_name = tree.children[0]  # 'len' или 'abs'
+_PARSER = Lark(GRAMMAR, parser='lalr', cache=True)
 
-        # Второй элемент - это дерево с выражением
-        arg_tree = tree.children[1]
-        arg = self._get_value(arg_tree)
+Number = Union[int, float]
 
-        if func_name == "len":
-            if isinstance(arg, list):
-                return len(arg)
-            raise TypeError(f"len() requires array, got {type(arg)}")
-        elif func_name == "abs":
-            if isinstance(arg, (int, float)):
-                return abs(arg)
-            raise TypeError(f"abs() requires number, got {type(arg)}")
-        raise ValueError(f"Unknown function: {func_name}")
+# Правила грамматики для арифметических операций и их знаки
+_OPERATORS = {"add": "+", "sub": "-", "mul": "*", "div": "/"}
 
-    def _zero_division_error(self):
-        """Вызывает ошибку деления на ноль"""
-        raise ZeroDivisionError("Division by zero")
+_Element = ET.Element
 
-    def CNAME(self, token):
-        return token.value
+_TAG_NUMBER = "number"
+_TAG_ARRAY = "array"
+_TAG_DICT = "dict"
+_TAG_ENTRY = "entry"
+_TAG_CONST = "const"
+_TAG_STRING = "string"
+_TAG_VALUE = "value"
 
-    def number(self, n):
-        val = float(n[0].value)
-        return int(val) if val.is_integer() else val
+# Атрибуты чисел общие для всех узлов, Element копирует их сам
+_INTEGER_ATTRIB = {"type": "integer"}
+_FLOAT_ATTRIB = {"type": "float"}
 
-    def array(self, items):
-        return [self._get_value(item) for item in items]
 
-    def dict(self, items):
-        return {k: self._get_value(v) for k, v in items}
+def _integer_element(value: int) -> ET.Element:
+    elem = _Element(_TAG_NUMBER, _INTEGER_ATTRIB)
+    try:
+        elem.text = str(value)
+    except ValueError:
+        # Результат вычисления длиннее предела int-строк Python
+        raise OverflowError("Integer too large to write") from None
+    return elem
 
-    def dict_entry(self, items):
-        key = str(items[0])
-        value = items[1]
-        return (key, value)
 
-    def const_expr(self, children):
-        return self._get_value(children[0])
+def _float_element(value: float) -> ET.Element:
+    elem = _Element(_TAG_NUMBER, _FLOAT_ATTRIB)
+    elem.text = str(value)
+    return elem
 
-    def const(self, children):
-        name = str(children[0])
-        raw_value = children[1]
 
-        # Вычисляем значение константы
-        value = self._get_value(raw_value)
-        self.constants[name] = value
-        return ('const', name, value)
+def _string_element(value: str) -> ET.Element:
+    elem = _Element(_TAG_STRING)
+    elem.text = value
+    return elem
 
-    def value(self, children):
-        return self._get_value(children[0])
 
-    def item(self, children):
-        return children[0]
+def _fallback_element(value: object) -> ET.Element:
+    elem = _Element(_TAG_VALUE)
+    elem.text = str(value)
+    return elem
 
-    def start(self, items):
-        return items
 
+# Числа и строки остаются значениями Python, пока участвуют в выражениях,
+# и превращаются в XML только там, где становятся частью документа
+_ELEMENT_BUILDERS: Dict[type, Callable[[Any], ET.Element]] = {
+    int: _integer_element,
+    float: _float_element,
+    str: _string_element,
+}
 
-def value_to_xml(value, parent):
-    if isinstance(value, (int, float)):
-        elem = ET.SubElement(parent, "number")
-        elem.text = str(value)
-        elem.set("type", "integer" if isinstance(value, int) else "float")
-    elif isinstance(value, list):
-        elem = ET.SubElement(parent, "array")
-        for item in value:
-            value_to_xml(item, elem)
-    elif isinstance(value, dict):
-        elem = ET.SubElement(parent, "dict")
-        for k, v in value.items():
-            entry = ET.SubElement(elem, "entry")
-            entry.set("key", str(k))
-            value_to_xml(v, entry)
-    elif isinstance(value, tuple) and value[0] == 'const':
-        elem = ET.SubElement(parent, "const")
-        elem.set("name", value[1])
-        value_to_xml(value[2], elem)
-    elif isinstance(value, str):
-        elem = ET.SubElement(parent, "string")
-        elem.text = value
-    else:
-        elem = ET.SubElement(parent, "value")
-        elem.text = str(value)
+
+def _to_element(value: object) -> ET.Element:
+    if isinstance(value, ET.Element):
+        return value
+    return _ELEMENT_BUILDERS.get(type(value), _fallback_element)(value)
+
+
+# Названия видов значений для сообщений об ошибках
+_VALUE_KINDS = {int: "integer", float: "float", str: "string"}
+_ELEMENT_KINDS = {_TAG_ARRAY: "array", _TAG_DICT: "table"}
 
 
-def prettify_xml(elem):
-    rough_string = ET.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="  ")
+def _kind(value: object) -> str:
+    if isinstance(value, ET.Element):
+        return _ELEMENT_KINDS.get(value.tag, str(value.tag))
+    return _VALUE_KINDS.get(type(value), type(value).__name__)
 
 
-def main():
+class ConfigTransformer(Transformer):
+    """Вычисляет конфигурацию и сразу строит из неё XML-документ"""
+
+    def __init__(self, root: Optional[ET.Element] = None) -> None:
+        self.root = root if root is not None else _Element("config")
+        # Числа и строки хранятся как значения, массивы и словари - как элементы
+        self.constants: Dict[str, object] = {}
+        # Методов для токенов нет: Token уже является str
+        super().__init__(visit_tokens=False)
+
+    @v_args(inline=True)
+    def add(self, left: Number, right: Number) -> Number:
+        return left + right
+
+    @v_args(inline=True)
+    def sub(self, left: Number, right: Number) -> Number:
+        return left - right
+
+    @v_args(inline=True)
+    def mul(self, left: Number, right: Number) -> Number:
+        return left * right
+
+    @v_args(inline=True)
+    def div(self, left: Number, right: Number) -> Number:
+        if right == 0:
+            raise ZeroDivisionError("Division by zero")
+        return left / right
+
+    @v_args(inline=True)
+    def const_ref(self, name: Token) -> object:
+        """Подставляет в выражение уже вычисленное значение константы"""
+        # Константа не может иметь значение None, поэтому хватает одного get
+        value = self.constants.get(name)
+        if value is None:
+            raise ValueError(f"Undefined constant: {name}")
+        # Строки в выражение не попадают, иначе арифметика могла бы, например,
+        # размножить строку до огромной длины. Массивы и словари проходят:
+        # их проверяют len(), abs() и сами операции
+        if type(value) is str:
+            raise TypeError(f"Constant '{name}' is a string and cannot be used in an expression")
+        return value
+
+    @v_args(inline=True)
+    def function(self, name: Token, arg: object) -> Number:
+        """Вычисляет функцию"""
+        if name == "len":
+            if isinstance(arg, ET.Element) and arg.tag == _TAG_ARRAY:
+                return len(arg)
+            raise TypeError(f"len() requires array, got {_kind(arg)}")
+        elif name == "abs":
+            # int проверяется отдельно: после isinstance(arg, (int, float))
+            # mypyc считает arg float и превращает целые в вещественные
+            if type(arg) is int:
+                return abs(arg)
+            if type(arg) is float:
+                return abs(arg)
+            raise TypeError(f"abs() requires number, got {_kind(arg)}")
+        raise ValueError(f"Unknown function: {name}")
+
+    @v_args(inline=True)
+    def number(self, token: Token) -> Number:
+        # Тип числа определяется по записи литерала, без промежуточного float
+        s = token.value
+        if '.' in s or 'e' in s or 'E' in s:
+            return float(s)
+        try:
+            return int(s)
+        except ValueError:
+            # Литерал длиннее предела int-строк Python: как и раньше, float (inf)
+            return float(s)
+
+    @v_args(inline=True)
+    def value_ref(self, name: Token) -> object:
+        """Подставляет значение константы вместо её имени"""
+        value = self.constants.get(name)
+        if value is None:
+            return str(name)
+        if isinstance(value, ET.Element):
+            # Элемент уже стоит в документе под своей константой
+            return copy.deepcopy(value)
+        return value
+
+    def array(self, items: List[object]) -> ET.Element:
+        elem = _Element(_TAG_ARRAY)
+        # Для пустого массива () Lark передаёт заглушку None вместо элементов
+        elem.extend([_to_element(item) for item in items if item is not None])
+        return elem
+
+    def dict(self, items: List[ET.Element]) -> ET.Element:
+        elem = _Element(_TAG_DICT)
+        # Повторный ключ заменяет значение, но остаётся на первом месте
+        elem.extend({entry.get("key"): entry for entry in items}.values())
+        return elem
+
+    def dict_entry(self, items: List[object]) -> ET.Element:
+        entry = _Element(_TAG_ENTRY, key=str(items[0]))
+        entry.append(_to_element(items[1]))
+        return entry
+
+    def const_expr(self, children: List[object]) -> object:
+        # Выражение уже свёрнуто во время трансформации. const_ref не пропускает
+        # в выражение строки, так что кроме числа здесь может оказаться лишь
+        # массив или словарь, например |(a)|. Он выводится как есть, но копией:
+        # сам элемент уже стоит в документе под своей константой
+        value = children[0]
+        if isinstance(value, ET.Element):
+            return copy.deepcopy(value)
+        return value
+
+    def const(self, children: List[object]) -> ET.Element:
+        # Одинаковые имена становятся одним объектом - быстрее поиск в constants
+        name = sys.intern(str(children[0]))
+        # Значение уже вычислено трансформером
+        value = children[1]
+        self.constants[name] = value
+        elem = _Element(_TAG_CONST, name=name)
+        elem.append(_to_element(value))
+        return elem
+
+    def start(self, items: List[ET.Element]) -> ET.Element:
+        self.root.extend(items)
+        return self.root
+
+
+def write_xml(elem: ET.Element, path: str) -> None:
+    ET.indent(elem, space="  ")
+    payload = ET.tostring(elem, encoding='utf-8', xml_declaration=True)
+    # Документ уже целиком в памяти. Буферизованный файл передаёт такую
+    # большую запись напрямую и, в отличие от FileIO, дописывает её до конца
+    with open(path, 'wb') as f:
+        f.write(payload)
+        f.write(b"\n")
+
+
+def main() -> None:
     parser = argparse.ArgumentParser(description="Configuration language to XML converter")
     parser.add_argument("-i", "--input", required=True, help="Input file path")
     parser.add_argument("-o", "--output", required=True, help="Output XML file path")
     args = parser.parse_args()
 
     try:
-        with open(args.input, 'r', encoding='utf-8') as f:
-            source = f.read()
+        # Читаем байты и декодируем весь файл одним вызовом
+        with open(args.input, 'rb') as f:
+            source = f.read().decode('utf-8')
     except FileNotFoundError:
         print(f"Error: Input file '{args.input}' not found")
         sys.exit(1)
 
     try:
-        parser = Lark(GRAMMAR, parser='lalr', transformer=ConfigTransformer())
-        result = parser.parse(source)
-
-        root = ET.Element("config")
-        for item in result:
-            value_to_xml(item, root)
-
-        xml_str = prettify_xml(root)
-
-        with open(args.output, 'w', encoding='utf-8') as f:
-            f.write(xml_str)
+        tree = _PARSER.parse(source)
+        try:
+            root = ConfigTransformer().transform(tree)
+        except VisitError as e:
+            # Transformer оборачивает исключения из методов в VisitError
+            if isinstance(e.orig_exc, TypeError) and e.rule in _OPERATORS:
+                # Операции не проверяют типы операндов сами, а const_ref
+                # пропускает в выражение кроме чисел только массивы и словари
+                raise TypeError(f"Operation '{_OPERATORS[e.rule]}' requires numbers, got array or table") from None
+            raise e.orig_exc from None
+
+        write_xml(root, args.output)
 
     except LarkError as e:
         print(f"Syntax error: {e}")
@@ -241,6 +306,10 @@ def main():
     except ZeroDivisionError:
         print(f"Runtime error: Division by zero")
         sys.exit(1)
+    except OverflowError:
+        # Точное целое не помещается во float при смешанной арифметике
+        print(f"Runtime error: Number too large")
+        sys.exit(1)
     except TypeError as e:
         print(f"Type error: {e}")
         sys.exit(1)
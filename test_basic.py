@@ -1,30 +1,130 @@
 import unittest
-from lark import Lark
-from converter import ConfigTransformer, GRAMMAR
+import xml.etree.ElementTree as ET
+from lark.exceptions import VisitError
+from converter import ConfigTransformer, _PARSER
 
 
 class TestBasic(unittest.TestCase):
     def test_simple(self):
         data = "const x = 5"
-        parser = Lark(GRAMMAR, parser='lalr', transformer=ConfigTransformer())
-        result = parser.parse(data)
-        print(f"Test 1 result: {result}")
-        self.assertEqual(result[0][2], 5)
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 1 result: {ET.tostring(root)}")
+        self.assertEqual(transformer.constants["x"], 5)
+        self.assertEqual(root.find("const/number").text, "5")
 
     def test_simple_expression(self):
         data = "const x = |10 / 2|"
-        parser = Lark(GRAMMAR, parser='lalr', transformer=ConfigTransformer())
-        result = parser.parse(data)
-        print(f"Test 2 result: {result}")
-        self.assertEqual(result[0][2], 5)
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 2 result: {ET.tostring(root)}")
+        self.assertEqual(transformer.constants["x"], 5)
 
     def test_const_reference(self):
         data = "const a = 10\nconst b = |a * 2|"
-        parser = Lark(GRAMMAR, parser='lalr', transformer=ConfigTransformer())
-        result = parser.parse(data)
-        print(f"Test 3 result: {result}")
-        self.assertEqual(result[1][2], 20)
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 3 result: {ET.tostring(root)}")
+        self.assertEqual(transformer.constants["b"], 20)
+
+    def test_functions(self):
+        data = "const a = (1, 2, 3)\nconst b = |len(a) + abs(-4)|"
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 4 result: {ET.tostring(root)}")
+        self.assertEqual(transformer.constants["b"], 7)
+        self.assertIs(type(transformer.constants["b"]), int)
+        self.assertEqual(root.find("const[@name='b']/number").get("type"), "integer")
+
+    def test_function_result_types(self):
+        data = "const a = (1, 2, 3)\nconst b = |abs(-4)|\nconst c = |len(a)|\nconst d = |abs(-2.5)|"
+        root = ConfigTransformer().transform(_PARSER.parse(data))
+        print(f"Test 4a result: {ET.tostring(root)}")
+        types = {name: root.find(f"const[@name='{name}']/number").get("type") for name in "bcd"}
+        self.assertEqual(types, {"b": "integer", "c": "integer", "d": "float"})
+
+    def test_constant_folding(self):
+        data = "const a = 2\nconst b = |(a + 1) * a|\nconst c = |b - a / 4|"
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 5 result: {ET.tostring(root)}")
+        self.assertEqual(transformer.constants["b"], 6)
+        self.assertEqual(transformer.constants["c"], 5.5)
+
+    def test_number_types(self):
+        data = "const a = (7, -3, 2.0, 1e2, 12345678901234567890)"
+        root = ConfigTransformer().transform(_PARSER.parse(data))
+        print(f"Test 6 result: {ET.tostring(root)}")
+        numbers = root.find("const/array")
+        self.assertEqual([n.get("type") for n in numbers],
+                         ["integer", "integer", "float", "float", "integer"])
+        self.assertEqual(numbers[4].text, "12345678901234567890")
+
+    def test_huge_numbers(self):
+        huge = "1" * 400
+        for data in [f"const n = {huge}\nconst b = |n / 2|", f"const n = {huge}\nconst b = |n * 1.5|"]:
+            with self.assertRaises(VisitError) as ctx:
+                ConfigTransformer().transform(_PARSER.parse(data))
+            self.assertIsInstance(ctx.exception.orig_exc, OverflowError)
+        transformer = ConfigTransformer()
+        transformer.transform(_PARSER.parse("const n = " + "1" * 5000))
+        self.assertEqual(transformer.constants["n"], float("inf"))
+
+    def test_empty_array(self):
+        data = "const a = ()\nconst b = |len(a)|\nconst c = ((), (1))"
+        transformer = ConfigTransformer()
+        root = transformer.transform(_PARSER.parse(data))
+        print(f"Test 6a result: {ET.tostring(root)}")
+        self.assertEqual(len(root.find("const[@name='a']/array")), 0)
+        self.assertEqual(transformer.constants["b"], 0)
+        self.assertEqual([len(a) for a in root.find("const[@name='c']/array")], [0, 1])
+
+    def test_repeated_table_key(self):
+        data = "const t = table([a = 1, b = 3, a = 2])"
+        root = ConfigTransformer().transform(_PARSER.parse(data))
+        print(f"Test 6b result: {ET.tostring(root)}")
+        entries = root.findall("const/dict/entry")
+        self.assertEqual([(e.get("key"), e.find("number").text) for e in entries],
+                         [("a", "2"), ("b", "3")])
+
+    def test_comments(self):
+        data = "! line comment\n/# block\n# comment #/\nconst x = /# inline #/ 1"
+        root = ConfigTransformer().transform(_PARSER.parse(data))
+        print(f"Test 7 result: {ET.tostring(root)}")
+        self.assertEqual(ET.tostring(root, encoding="unicode"),
+                         '<config><const name="x"><number type="integer">1</number></const></config>')
+
+    def test_expression_type_error(self):
+        data = "const a = (1, 2)\nconst b = |a * 2|"
+        with self.assertRaises(VisitError) as ctx:
+            ConfigTransformer().transform(_PARSER.parse(data))
+        self.assertIsInstance(ctx.exception.orig_exc, TypeError)
+
+    def test_function_type_errors(self):
+        for data, message in [("const a = (1)\nconst b = |abs(a)|", "abs() requires number, got array"),
+                              ("const b = |len(3)|", "len() requires array, got integer"),
+                              ("const t = table([k = 1])\nconst b = |len(t)|", "len() requires array, got table")]:
+            with self.assertRaises(VisitError) as ctx:
+                ConfigTransformer().transform(_PARSER.parse(data))
+            self.assertEqual(str(ctx.exception.orig_exc), message)
+
+    def test_bare_reference_in_expression(self):
+        data = "const a = (1, 2)\nconst s = foo\nconst x = |a|\nconst y = |s|\nconst z = |q|\nconst w = |(a)|"
+        root = ConfigTransformer().transform(_PARSER.parse(data))
+        print(f"Test 8a result: {ET.tostring(root)}")
+        self.assertEqual(ET.tostring(root.find("const[@name='x']/array")),
+                         ET.tostring(root.find("const[@name='a']/array")))
+        self.assertEqual(root.find("const[@name='y']/string").text, "foo")
+        self.assertEqual(root.find("const[@name='z']/string").text, "q")
+        self.assertEqual(len(root.find("const[@name='w']/array")), 2)
+
+    def test_string_in_expression(self):
+        data = "const s = foo\nconst b = |s * 50000000|"
+        with self.assertRaises(VisitError) as ctx:
+            ConfigTransformer().transform(_PARSER.parse(data))
+        self.assertIsInstance(ctx.exception.orig_exc, TypeError)
+        self.assertIn("'s'", str(ctx.exception.orig_exc))
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()